@@ -80,13 +80,12 @@ class Object:
 
     core_type_name = 'void*'
 
-    def __init__(self, core_type_name=None):
+    def __init__(self, core_type_name=None, obj=None):
         self.ffi_type_name = (core_type_name if core_type_name is not None else self.core_type_name) + '*'
-        self._reset_handle()
-
-    def __init__(self, core_type_name, obj):
-        self.ffi_type_name = (core_type_name if core_type_name is not None else self.core_type_name) + '*'
-        self._handle_ptr = ffi.cast(self.ffi_type_name, obj._handle_ptr)
+        if obj is None:
+            self._reset_handle()
+        else:
+            self._handle_ptr = ffi.cast(self.ffi_type_name, obj._handle_ptr)
 
     def _reset_handle(self):
         self._handle_ptr = ffi.new(self.ffi_type_name, ffi.NULL)
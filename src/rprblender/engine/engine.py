@@ -24,7 +24,6 @@ import weakref
 import numpy as np
 
 import bpy
-import mathutils
 import pyrpr
 
 from .context import RPRContext
@@ -32,11 +31,51 @@ from rprblender.export import object, instance
 from rprblender.properties.view_layer import RPR_ViewLayerProperites
 from . import image_filter
 
-from rprblender.utils import logging
+from rprblender.utils import logging, conversion
 log = logging.Log(tag='Engine')
 
 
-ITERATED_OBJECT_TYPES = ('MESH', 'LIGHT', 'CURVE', 'FONT', 'SURFACE', 'META', 'VOLUME')
+ITERATED_OBJECT_TYPES = frozenset(('MESH', 'LIGHT', 'CURVE', 'FONT', 'SURFACE', 'META', 'VOLUME'))
+ITERATED_OBJECT_TYPES_WITH_CAMERA = ITERATED_OBJECT_TYPES | {'CAMERA'}
+
+# same threshold as mathutils Quaternion.axis uses to treat rotation as zero
+ROTATION_AXIS_EPSILON = 0.0005
+
+# render pass name to corresponded rpr AOV
+PASS_AOVS = {aov['name']: aov['rpr'] for aov in RPR_ViewLayerProperites.aovs_info +
+             RPR_ViewLayerProperites.cryptomatte_aovs_info}
+
+# image filter inputs with corresponded AOVs, None is the default rendered image
+IMAGE_FILTER_INPUTS = {
+    'BILATERAL': {
+        'color': None,
+        'normal': pyrpr.AOV_SHADING_NORMAL,
+        'world_coordinate': pyrpr.AOV_WORLD_COORDINATE,
+        'object_id': pyrpr.AOV_OBJECT_ID,
+    },
+    'EAW': {
+        'color': None,
+        'normal': pyrpr.AOV_SHADING_NORMAL,
+        'depth': pyrpr.AOV_DEPTH,
+        'trans': pyrpr.AOV_OBJECT_ID,
+        'world_coordinate': pyrpr.AOV_WORLD_COORDINATE,
+        'object_id': pyrpr.AOV_OBJECT_ID,
+    },
+    'LWR': {
+        'color': None,
+        'normal': pyrpr.AOV_SHADING_NORMAL,
+        'depth': pyrpr.AOV_DEPTH,
+        'trans': pyrpr.AOV_OBJECT_ID,
+        'world_coordinate': pyrpr.AOV_WORLD_COORDINATE,
+        'object_id': pyrpr.AOV_OBJECT_ID,
+    },
+    'ML': {
+        'color': None,
+        'depth': pyrpr.AOV_DEPTH,
+        'albedo': pyrpr.AOV_DIFFUSE_ALBEDO,
+        'normal': pyrpr.AOV_SHADING_NORMAL,
+    },
+}
 
 
 class Engine:
@@ -68,56 +107,82 @@ class Engine:
         :param render_passes: render passes to collect
         :return: images
         """
-        def zeros_image(channels):
-            return np.zeros((self.rpr_context.height, self.rpr_context.width, channels), dtype=np.float32)
+        # every frame buffer is read from rpr_context at most once per call,
+        # default image and AOV_COLOR image could be taken from the same frame buffer
+        images = {}
 
-        images = []
+        def get_image(aov_type=None):
+            fb = self.rpr_context.get_frame_buffer(aov_type)
+            image = images.get(fb, None)
+            if image is None:
+                image = fb.get_data()
+                images[fb] = image
 
-        for p in render_passes:
-            # finding corresponded aov
+            return image
 
-            if p.name == "Combined":
-                if apply_image_filter and self.image_filter:
-                    image = self.image_filter.get_data()
-
-                    if self.background_filter:
-                        self.update_background_filter_inputs(color_image=image)
-                        self.background_filter.run()
-                        image = self.background_filter.get_data()
-                    else:
-                        # copying alpha component from rendered image to final denoised image,
-                        # because image filter changes it to 1.0
-                        image[:, :, 3] = self.rpr_context.get_image()[:, :, 3]
-
-                elif self.background_filter:
-                    self.update_background_filter_inputs()
+        def get_combined_image():
+            if apply_image_filter and self.image_filter:
+                image = self.image_filter.get_data()
+
+                if self.background_filter:
+                    self.update_background_filter_inputs(color_image=image)
                     self.background_filter.run()
                     image = self.background_filter.get_data()
                 else:
-                    image = self.rpr_context.get_image()
+                    # copying alpha component from rendered image to final denoised image,
+                    # because image filter changes it to 1.0
+                    image[:, :, 3] = get_image()[:, :, 3]
+
+            elif self.background_filter:
+                self.update_background_filter_inputs(color_image=get_image(pyrpr.AOV_COLOR),
+                                                     opacity_image=get_image(pyrpr.AOV_OPACITY))
+                self.background_filter.run()
+                image = self.background_filter.get_data()
+            else:
+                image = get_image()
+
+            return image
+
+        # only Combined pass is requested in material preview and final render without
+        # enabled AOVs, its image is set as is without copying to intermediate buffer
+        if len(render_passes) == 1 and render_passes[0].name == "Combined":
+            p = render_passes[0]
+            render_passes.foreach_set('rect', get_combined_image()[:, :, 0:p.channels].ravel())
+            return
+
+        width, height = self.rpr_context.width, self.rpr_context.height
+
+        # single flat buffer for all passes, every pass image is copied directly into its own slot
+        buf = np.empty(width * height * sum(p.channels for p in render_passes), dtype=np.float32)
+        offset = 0
+
+        for p in render_passes:
+            # finding corresponded aov
+
+            if p.name == "Combined":
+                image = get_combined_image()
 
             elif p.name == "Color":
-                image = self.rpr_context.get_image(pyrpr.AOV_COLOR)
+                image = get_image(pyrpr.AOV_COLOR)
 
             else:
-                aovs_info = RPR_ViewLayerProperites.cryptomatte_aovs_info \
-                    if "Cryptomatte" in p.name else RPR_ViewLayerProperites.aovs_info
-                aov = next((aov for aov in aovs_info
-                            if aov['name'] == p.name), None)
-                if aov and self.rpr_context.is_aov_enabled(aov['rpr']):
-                    image = self.rpr_context.get_image(aov['rpr'])
+                aov = PASS_AOVS.get(p.name, None)
+                if aov is not None and self.rpr_context.is_aov_enabled(aov):
+                    image = get_image(aov)
                 else:
                     log.warn(f"AOV '{p.name}' is not enabled in rpr_context "
                              f"or not found in aovs_info")
-                    image = zeros_image(p.channels)
-
-            if p.channels != image.shape[2]:
-                image = image[:, :, 0:p.channels]
+                    image = None
 
-            images.append(image.flatten())
+            size = width * height * p.channels
+            if image is None:
+                buf[offset:offset + size].fill(0.0)
+            else:
+                buf[offset:offset + size].reshape(height, width, p.channels)[:] = image[:, :, 0:p.channels]
+            offset += size
 
         # efficient way to copy all AOV images
-        render_passes.foreach_set('rect', np.concatenate(images))
+        render_passes.foreach_set('rect', buf)
 
     def update_render_result(self, tile_pos, tile_size, layer_name="",
                              apply_image_filter=False):
@@ -128,7 +193,7 @@ class Engine:
     def depsgraph_objects(self, depsgraph: bpy.types.Depsgraph, with_camera=False):
         """ Iterates evaluated objects in depsgraph with ITERATED_OBJECT_TYPES """
 
-        object_types = ITERATED_OBJECT_TYPES if not with_camera else (ITERATED_OBJECT_TYPES + ('CAMERA',))
+        object_types = ITERATED_OBJECT_TYPES if not with_camera else ITERATED_OBJECT_TYPES_WITH_CAMERA
 
         for obj in depsgraph.objects:
             if obj.type in object_types:
@@ -145,27 +210,66 @@ class Engine:
 
     def sync_motion_blur(self, depsgraph: bpy.types.Depsgraph):
 
-        def set_motion_blur(rpr_object, prev_matrix, cur_matrix):
-            if hasattr(rpr_object, 'set_motion_transform'):
-                rpr_object.set_motion_transform(
-                    np.array(prev_matrix, dtype=np.float32).reshape(4, 4))
-            else:
-                velocity = (prev_matrix - cur_matrix).to_translation()
-                rpr_object.set_linear_motion(*velocity)
+        def set_motion_blur(motion_data):
+            """ Sets motion blur for list of (rpr_object, prev_matrix, cur_matrix) """
+
+            rpr_objects = []
+            prev_mats = []
+            cur_mats = []
+            for rpr_object, prev_matrix, cur_matrix in motion_data:
+                if hasattr(rpr_object, 'set_motion_transform'):
+                    rpr_object.set_motion_transform(prev_matrix)
+                else:
+                    rpr_objects.append(rpr_object)
+                    prev_mats.append(prev_matrix)
+                    cur_mats.append(cur_matrix)
 
-                mul_diff = prev_matrix @ cur_matrix.inverted()
+            if not rpr_objects:
+                return
 
-                quaternion = mul_diff.to_quaternion()
-                if quaternion.axis.length > 0.5:
-                    rpr_object.set_angular_motion(*quaternion.axis, quaternion.angle)
+            # calculating linear, angular and scale motion for all objects at once
+            prev_mats = np.array(prev_mats)
+            cur_mats = np.array(cur_mats)
+
+            velocities = (prev_mats - cur_mats)[:, :3, 3]
+            mul_diffs = prev_mats @ np.linalg.inv(cur_mats)
+
+            quaternions = conversion.matrices_to_quaternions(mul_diffs)
+            axes_length = np.linalg.norm(quaternions[:, 1:], axis=1)
+            angles = 2.0 * np.arccos(np.clip(quaternions[:, 0], -1.0, 1.0))
+            scale_motions = np.linalg.norm(mul_diffs[:, :3, :3], axis=1) - 1.0
+
+            for rpr_object, velocity, quaternion, axis_length, angle, scale_motion in zip(
+                    rpr_objects, velocities.tolist(), quaternions.tolist(),
+                    axes_length.tolist(), angles.tolist(), scale_motions.tolist()):
+                rpr_object.set_linear_motion(*velocity)
+
+                # rotation axis is undefined for nearly zero rotation
+                if axis_length >= ROTATION_AXIS_EPSILON:
+                    rpr_object.set_angular_motion(*(v / axis_length for v in quaternion[1:]), angle)
                 else:
                     rpr_object.set_angular_motion(1.0, 0.0, 0.0, 0.0)
 
                 if not isinstance(rpr_object, pyrpr.Camera):
-                    scale_motion = mul_diff.to_scale() - mathutils.Vector((1, 1, 1))
                     rpr_object.set_scale_motion(*scale_motion)
 
-        cur_matrices = {}
+        def get_cur_matrix(rpr_object, obj):
+            # only previous matrix is needed for objects with motion transform
+            if hasattr(rpr_object, 'set_motion_transform'):
+                return None
+
+            return np.array(obj.matrix_world, dtype=np.float32)
+
+        # rpr objects which support motion blur, cameras are created only for object keys
+        blur_capable = {key: rpr_object for key, rpr_object in self.rpr_context.objects.items()
+                        if isinstance(rpr_object, (pyrpr.Shape, pyrpr.AreaLight, pyrpr.Camera))}
+        if not blur_capable:
+            return
+
+        # object key: (rpr_object, cur_matrix) of objects with motion blur
+        blur_objects = {}
+        # instance key: (rpr_object, cur_matrix) of instances with motion blur
+        blur_instances = {}
 
         # getting current frame matrices
         for obj in self.depsgraph_objects(depsgraph, with_camera=True):
@@ -173,24 +277,24 @@ class Engine:
                 continue
 
             key = object.key(obj)
-            rpr_object = self.rpr_context.objects.get(key, None)
-            if not rpr_object or not isinstance(rpr_object, (pyrpr.Shape, pyrpr.AreaLight, pyrpr.Camera)):
+            rpr_object = blur_capable.get(key, None)
+            if rpr_object is None:
                 continue
 
-            cur_matrices[key] = obj.matrix_world.copy()
+            blur_objects[key] = (rpr_object, get_cur_matrix(rpr_object, obj))
 
         for inst in self.depsgraph_instances(depsgraph):
             if not inst.parent.rpr.motion_blur:
                 continue
 
             key = instance.key(inst)
-            rpr_object = self.rpr_context.objects.get(key, None)
-            if not rpr_object or not isinstance(rpr_object, (pyrpr.Shape, pyrpr.AreaLight)):
+            rpr_object = blur_capable.get(key, None)
+            if rpr_object is None:
                 continue
 
-            cur_matrices[key] = inst.matrix_world.copy()
+            blur_instances[key] = (rpr_object, get_cur_matrix(rpr_object, inst))
 
-        if not cur_matrices:
+        if not blur_objects and not blur_instances:
             return
 
         cur_frame = depsgraph.scene.frame_current
@@ -199,21 +303,28 @@ class Engine:
         # set to previous frame and calculate motion blur data
         self._set_scene_frame(depsgraph.scene, prev_frame, 0.0)
         try:
-            for obj in self.depsgraph_objects(depsgraph, with_camera=True):
-                key = object.key(obj)
-                cur_matrix = cur_matrices.get(key, None)
-                if cur_matrix is None:
-                    continue
+            motion_data = []
+
+            if blur_objects:
+                for obj in self.depsgraph_objects(depsgraph, with_camera=True):
+                    blur_data = blur_objects.get(object.key(obj), None)
+                    if blur_data is None:
+                        continue
 
-                set_motion_blur(self.rpr_context.objects[key], obj.matrix_world, cur_matrix)
+                    rpr_object, cur_matrix = blur_data
+                    motion_data.append((rpr_object, np.array(obj.matrix_world, dtype=np.float32), cur_matrix))
 
-            for inst in self.depsgraph_instances(depsgraph):
-                key = instance.key(inst)
-                cur_matrix = cur_matrices.get(key, None)
-                if cur_matrix is None:
-                    continue
+            # references to instances can't be kept, so depsgraph instances are iterated only if needed
+            if blur_instances:
+                for inst in self.depsgraph_instances(depsgraph):
+                    blur_data = blur_instances.get(instance.key(inst), None)
+                    if blur_data is None:
+                        continue
 
-                set_motion_blur(self.rpr_context.objects[key], inst.matrix_world, cur_matrix)
+                    rpr_object, cur_matrix = blur_data
+                    motion_data.append((rpr_object, np.array(inst.matrix_world, dtype=np.float32), cur_matrix))
+
+            set_motion_blur(motion_data)
 
         finally:
             # restore current frame
@@ -349,64 +460,23 @@ class Engine:
             self.image_filter.update_param('bandwidth', settings['bandwidth'])
 
     def update_image_filter_inputs(self, tile_pos=(0, 0)):
-        color = self.rpr_context.get_image()
-
         filter_type = self.image_filter.settings['filter_type']
-        if filter_type == 'BILATERAL':
-            world = self.rpr_context.get_image(pyrpr.AOV_WORLD_COORDINATE)
-            object_id = self.rpr_context.get_image(pyrpr.AOV_OBJECT_ID)
-            shading = self.rpr_context.get_image(pyrpr.AOV_SHADING_NORMAL)
-
-            inputs = {
-                'color': color,
-                'normal': shading,
-                'world_coordinate': world,
-                'object_id': object_id,
-            }
-
-        elif filter_type == 'EAW':
-            world = self.rpr_context.get_image(pyrpr.AOV_WORLD_COORDINATE)
-            object_id = self.rpr_context.get_image(pyrpr.AOV_OBJECT_ID)
-            depth = self.rpr_context.get_image(pyrpr.AOV_DEPTH)
-            shading = self.rpr_context.get_image(pyrpr.AOV_SHADING_NORMAL)
-
-            inputs = {
-                'color': color,
-                'normal': shading,
-                'depth': depth,
-                'trans': object_id,
-                'world_coordinate': world,
-                'object_id': object_id,
-            }
-
-        elif filter_type == 'LWR':
-            world = self.rpr_context.get_image(pyrpr.AOV_WORLD_COORDINATE)
-            object_id = self.rpr_context.get_image(pyrpr.AOV_OBJECT_ID)
-            depth = self.rpr_context.get_image(pyrpr.AOV_DEPTH)
-            shading = self.rpr_context.get_image(pyrpr.AOV_SHADING_NORMAL)
-
-            inputs = {
-                'color': color,
-                'normal': shading,
-                'depth': depth,
-                'trans': object_id,
-                'world_coordinate': world,
-                'object_id': object_id,
-            }
-
-        elif filter_type == 'ML':
-            inputs = {'color': color}
+        filter_inputs = IMAGE_FILTER_INPUTS.get(filter_type, None)
+        if filter_inputs is None:
+            raise ValueError("Incorrect filter type", filter_type)
 
-            if not self.image_filter.settings['ml_color_only']:
-                inputs['depth'] = self.rpr_context.get_image(pyrpr.AOV_DEPTH)
-                inputs['albedo'] = self.rpr_context.get_image(pyrpr.AOV_DIFFUSE_ALBEDO)
-                inputs['normal'] = self.rpr_context.get_image(pyrpr.AOV_SHADING_NORMAL)
+        if filter_type == 'ML' and self.image_filter.settings['ml_color_only']:
+            filter_inputs = {'color': None}
 
-        else:
-            raise ValueError("Incorrect filter type", filter_type)
+        # some inputs use the same AOV, each AOV image is read only once
+        images = {}
+        for input_id, aov_type in filter_inputs.items():
+            image = images.get(aov_type, None)
+            if image is None:
+                image = self.rpr_context.get_image(aov_type)
+                images[aov_type] = image
 
-        for input_id, data in inputs.items():
-            self.image_filter.update_input(input_id, data, tile_pos)
+            self.image_filter.update_input(input_id, image, tile_pos)
 
     def setup_background_filter(self, settings):
         if self.background_filter and self.background_filter.settings == settings:
@@ -59,17 +59,26 @@ class ExportEngine(Engine):
 
         world.sync(self.rpr_context, scene.world)
 
-        # camera, objects, particles
-        for obj in self.depsgraph_objects(depsgraph, with_camera=True):
-            indirect_only = obj.original.indirect_only_get(view_layer=depsgraph.view_layer)
+        view_layer = depsgraph.view_layer
+        frame_current = scene.frame_current
+
+        # objects, particles; scene camera is exported below
+        for obj in self.depsgraph_objects(depsgraph, with_camera=False):
+            indirect_only = obj.original.indirect_only_get(view_layer=view_layer)
             object.sync(self.rpr_context, obj, indirect_only=indirect_only,
-                        frame_current=scene.frame_current)
+                        frame_current=frame_current)
 
-        # instances
+        # instances, many of them usually share the same parent
+        parents_indirect_only = {}
         for inst in self.depsgraph_instances(depsgraph):
-            indirect_only = inst.parent.original.indirect_only_get(view_layer=depsgraph.view_layer)
+            parent_key = object.key(inst.parent)
+            indirect_only = parents_indirect_only.get(parent_key, None)
+            if indirect_only is None:
+                indirect_only = inst.parent.original.indirect_only_get(view_layer=view_layer)
+                parents_indirect_only[parent_key] = indirect_only
+
             instance.sync(self.rpr_context, inst, indirect_only=indirect_only,
-                          frame_current=scene.frame_current)
+                          frame_current=frame_current)
 
         # rpr_context parameters
         self.rpr_context.set_parameter(pyrpr.CONTEXT_PREVIEW, False)
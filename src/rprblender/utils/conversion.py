@@ -14,6 +14,8 @@
 #********************************************************************
 import math
 
+import numpy as np
+
 
 def convert_kelvins_to_rgb_bartlett(color_temperature: float) -> tuple:
     """
@@ -71,3 +73,66 @@ convert_kelvins_to_rgb = convert_kelvins_to_rgb_bartlett
 def perfcounter_to_str(val):
     """ Convert perfcounter difference to time string minutes-seconds-milliseconds """
     return f"{math.floor(val / 60)}m {math.floor(val % 60)}s {math.floor((val % 1) * 1000)}ms"
+
+
+def matrices_to_quaternions(matrices: np.ndarray) -> np.ndarray:
+    """
+    Convert array of 3x3 or 4x4 matrices to array of (w, x, y, z) quaternions.
+    Like mathutils Matrix.to_quaternion() columns are normalized to remove scale first,
+    result quaternions are normalized with non-negative w component.
+    Uses Shepperd's method: branch is selected by the largest diagonal term for numerical stability.
+    """
+    m = np.asarray(matrices, dtype=np.float64)[:, :3, :3]
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    m = np.divide(m, norms, out=np.zeros_like(m), where=norms > 0.0)
+
+    m00, m11, m22 = m[:, 0, 0], m[:, 1, 1], m[:, 2, 2]
+    trace = m00 + m11 + m22
+    branch = np.argmax(np.stack((trace, m00, m11, m22), axis=1), axis=1)
+
+    quaternions = np.empty((len(m), 4), dtype=np.float64)
+
+    i = branch == 0
+    if i.any():
+        mi = m[i]
+        w = 0.5 * np.sqrt(1.0 + trace[i])
+        s = 0.25 / w
+        quaternions[i] = np.stack((w,
+                                   (mi[:, 2, 1] - mi[:, 1, 2]) * s,
+                                   (mi[:, 0, 2] - mi[:, 2, 0]) * s,
+                                   (mi[:, 1, 0] - mi[:, 0, 1]) * s), axis=1)
+
+    i = branch == 1
+    if i.any():
+        mi = m[i]
+        x = 0.5 * np.sqrt(1.0 + m00[i] - m11[i] - m22[i])
+        s = 0.25 / x
+        quaternions[i] = np.stack(((mi[:, 2, 1] - mi[:, 1, 2]) * s,
+                                   x,
+                                   (mi[:, 0, 1] + mi[:, 1, 0]) * s,
+                                   (mi[:, 0, 2] + mi[:, 2, 0]) * s), axis=1)
+
+    i = branch == 2
+    if i.any():
+        mi = m[i]
+        y = 0.5 * np.sqrt(1.0 - m00[i] + m11[i] - m22[i])
+        s = 0.25 / y
+        quaternions[i] = np.stack(((mi[:, 0, 2] - mi[:, 2, 0]) * s,
+                                   (mi[:, 0, 1] + mi[:, 1, 0]) * s,
+                                   y,
+                                   (mi[:, 1, 2] + mi[:, 2, 1]) * s), axis=1)
+
+    i = branch == 3
+    if i.any():
+        mi = m[i]
+        z = 0.5 * np.sqrt(1.0 - m00[i] - m11[i] + m22[i])
+        s = 0.25 / z
+        quaternions[i] = np.stack(((mi[:, 1, 0] - mi[:, 0, 1]) * s,
+                                   (mi[:, 0, 2] + mi[:, 2, 0]) * s,
+                                   (mi[:, 1, 2] + mi[:, 2, 1]) * s,
+                                   z), axis=1)
+
+    quaternions /= np.linalg.norm(quaternions, axis=1, keepdims=True)
+    quaternions[quaternions[:, 0] < 0.0] *= -1.0
+
+    return quaternions